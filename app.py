@@ -1,7 +1,61 @@
-from flask import Flask, request, abort, jsonify
+import os
+import orjson
+from flask import Flask, Response, request, abort
 from flask_cors import CORS
-from models import setup_db, date_valid, Movie, Actor
-from auth import AuthError, requires_auth
+from sqlalchemy.exc import IntegrityError
+from models import setup_db, parse_date, db, Movie, Actor
+from auth import AuthError, requires_auth, prefetch_jwks
+from cache import cached_response, CACHE_SHORT
+
+
+# Comma separated origins allowed to make cross-origin requests, ignoring whitespace around each origin.
+ALLOWED_ORIGINS = [origin.strip() for origin in os.environ.get('ALLOWED_ORIGINS', '*').split(',') if origin.strip()]
+
+# Accepted (upper case) values for an actor's gender.
+VALID_GENDERS = frozenset({'M', 'F', 'X'})
+
+# Bodies of the static error responses, serialized once at import time.
+ERROR_400 = orjson.dumps({"success": False, "error": 400, "message": "bad request"})
+ERROR_401 = orjson.dumps({"success": False, "error": 401, "message": "unauthorized"})
+ERROR_404 = orjson.dumps({"success": False, "error": 404, "message": "resource not found"})
+ERROR_422 = orjson.dumps({"success": False, "error": 422, "message": "unprocessable"})
+
+
+'''
+ojson(obj, status) serializes obj with orjson and returns it as a JSON response with the given status code.
+Dates are serialized natively in the 'YYYY-MM-DD' format.
+'''
+
+
+def ojson(obj, status=200):
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+'''
+ojson_list(key, json_text) returns a successful JSON response whose key holds an array that is already JSON text.
+The array (i.e. from Actor.format_all()) is spliced into the body as is, so it is never decoded and re-encoded.
+'''
+
+
+def ojson_list(key, json_text):
+    body = b'{"success":true,"%s":%s}' % (key.encode(), json_text.encode())
+    return Response(body, mimetype='application/json')
+
+
+'''
+get_body() parses the JSON body of the current request with orjson.
+It returns an empty dict if the request has no body and aborts with 400 Bad Request if the body is not a JSON object.
+'''
+
+
+def get_body():
+    try:
+        body = orjson.loads(request.get_data(cache=False) or b'{}')
+    except orjson.JSONDecodeError:
+        abort(400)
+    if not isinstance(body, dict):
+        abort(400)
+    return body
 
 
 '''
@@ -12,7 +66,11 @@ create_app() creates and configures the app.
 def create_app(test_config=None):
     app = Flask(__name__)
     setup_db(app)
-    CORS(app)
+    prefetch_jwks()
+    # Browsers cache the answer to a preflight request for a day. Flask answers OPTIONS itself,
+    # so preflight requests never reach requires_auth or the database.
+    CORS(app, resources={r"/*": {"origins": ALLOWED_ORIGINS}},
+         methods=['GET', 'POST', 'PATCH', 'DELETE'], max_age=86400)
 
     # ----------------------------------------
     # API Endpoints
@@ -23,20 +81,18 @@ def create_app(test_config=None):
         - requires 'get:actors' permission.
         - returns status code 200 and json {"success": True, "actors": actors} where actors is the list of all stored actors
             or appropriate status code indicating reason for failure.
+        - the response is cached and tagged with an ETag; returns status code 304 if it matches If-None-Match.
     '''
 
     @app.route('/actors')
     @requires_auth('get:actors')
+    @cached_response('actors', ttl=CACHE_SHORT)
     def get_all_actors(payload):
-        selection = Actor.query.all()
-        actors = [actor.format() for actor in selection]
+        actors = Actor.format_all()
         # Abort if there are no actors in the database.
-        if len(actors) == 0:
+        if not actors:
             abort(404)
-        return jsonify({
-            'success': True,
-            'actors': actors
-        })
+        return ojson_list('actors', actors)
 
     '''
     Endpoint POST /actors:
@@ -50,7 +106,7 @@ def create_app(test_config=None):
     def create_actor(payload):
         try:
             # Get new actor data from request.
-            body = request.get_json()
+            body = get_body()
             req_name = body.get('name', None)
             req_birth_date = body.get('birth_date', None)
             req_gender = body.get('gender', None)
@@ -60,23 +116,25 @@ def create_app(test_config=None):
                 return abort(422)
 
             # Validate that the birth date is the proper format, if not, abort.
-            if not date_valid(req_birth_date):
+            birth_date = parse_date(req_birth_date)
+            if birth_date is None:
                 return abort(422)
 
             # Validate that the gender is the proper format, if not, abort.
-            if (req_gender.upper() != 'M') and (req_gender.upper() != 'F') and (req_gender.upper() != 'X'):
+            gender = req_gender.upper()
+            if gender not in VALID_GENDERS:
                 return abort(422)
 
-            # Format and create the actor object.
-            actor = Actor(name=req_name, birth_date=req_birth_date, gender=req_gender.upper())
-
-            # Abort if the actor is already present in the database.
-            if actor.is_duplicate():
+            # Create a row in the database for the actor in a single statement, aborting if the actor is already present.
+            # A concurrent insert of the same value can still violate the plain unique constraint.
+            try:
+                actor = Actor.insert_if_new(name=req_name, birth_date=birth_date, gender=gender)
+            except IntegrityError:
+                db.session.rollback()
                 abort(422)
-
-            # Otherwise, create a row in the database for the actor.
-            actor.insert()
-            return jsonify({'success': True, "actor": actor.format()})
+            if actor is None:
+                abort(422)
+            return ojson({'success': True, "actor": actor})
         except AuthError:
             abort(422)
 
@@ -84,8 +142,9 @@ def create_app(test_config=None):
     Endpoint PATCH /actors/<actor_id>:
         - <actor_id> is the existing actor's id
         - requires 'patch:actors' permission.
-        - updates the corresponding row for <actor_id>.
+        - updates the corresponding row for <actor_id> in a single UPDATE ... RETURNING statement.
         - responds with a 404 error if <actor_id> is not found.
+        - responds with a 422 error if the new name belongs to another actor.
         - returns status code 200 and json {"success": True, "actor": actor} where actor is the updated actor
             or appropriate status code indicating reason for failure.
     '''
@@ -94,30 +153,41 @@ def create_app(test_config=None):
     @requires_auth('patch:actors')
     def modify_actor(payload, actor_id):
         try:
-            # Find the actor with the given id, if they don't exist abort.
-            actor = Actor.query.filter(Actor.actor_id == actor_id).one_or_none()
-            if actor is None:
-                abort(404)
-
             # Retrieve the updated actor data.
-            body = request.get_json()
+            body = get_body()
             req_name = body.get('name', None)
             req_birth_date = body.get('birth_date', None)
             req_gender = body.get('gender', None)
 
-            # Update the actor with the new values.
+            # Validate and collect the new values.
+            values = {}
             if req_name is not None:
-                actor.name = req_name
+                values['name'] = req_name
             if req_birth_date is not None:
-                if not date_valid(req_birth_date):
+                birth_date = parse_date(req_birth_date)
+                if birth_date is None:
                     abort(422)
-                actor.birth_date = req_birth_date
+                values['birth_date'] = birth_date
             if req_gender is not None:
-                if (req_gender.upper() != 'M') and (req_gender.upper() != 'F') and (req_gender.upper() != 'X'):
+                gender = req_gender.upper()
+                if gender not in VALID_GENDERS:
                     return abort(422)
-                actor.gender = req_gender.upper()
-            actor.update()
-            return jsonify({"success": True, "actor": actor.format()})
+                values['gender'] = gender
+
+            # Update the actor with the given id in a single statement, if they don't exist abort.
+            if values:
+                try:
+                    actor = Actor.update_by_id(actor_id, **values)
+                except IntegrityError:
+                    db.session.rollback()
+                    abort(422)
+            else:
+                actor = Actor.query.get(actor_id)
+                if actor is not None:
+                    actor = actor.format()
+            if actor is None:
+                abort(404)
+            return ojson({"success": True, "actor": actor})
         except AuthError:
             abort(422)
 
@@ -125,7 +195,7 @@ def create_app(test_config=None):
     Endpoint DELETE /actors/<actor_id>: 
         - <actor_id> is the existing actor's id
         - requires 'delete:actors' permission.
-        - deletes the corresponding row for <actor_id>.
+        - deletes the corresponding row for <actor_id> in a single DELETE ... RETURNING statement.
         - responds with a 404 error if <actor_id> is not found.
         - returns status code 200 and json {"success": True, "delete": actor_id} where actor_id is the id for the deleted actor
             or appropriate status code indicating reason for failure.
@@ -135,36 +205,31 @@ def create_app(test_config=None):
     @requires_auth('delete:actors')
     def delete_actor(payload, actor_id):
         try:
-            # Find the actor with the given id, if they don't exist abort.
-            actor = Actor.query.filter(Actor.actor_id == actor_id).one_or_none()
-            if actor is None:
+            # Delete the actor with the given id in a single statement, if they don't exist abort.
+            if not Actor.delete_by_id(actor_id):
                 abort(404)
-
-            actor.delete()
-            return jsonify({"success": True, "delete": actor_id})
+            return ojson({"success": True, "delete": actor_id})
         except AuthError:
             abort(422)
 
     '''
-    Endpoint GET /actors:
-        - requires 'get:actors' permission.
-        - returns status code 200 and json {"success": True, "actors": actors} where actors is the list of all stored actors
+    Endpoint GET /movies:
+        - requires 'get:movies' permission.
+        - returns status code 200 and json {"success": True, "movies": movies} where movies is the list of all stored movies
             or appropriate status code indicating reason for failure.
+        - the response is cached and tagged with an ETag; returns status code 304 if it matches If-None-Match.
     '''
 
     @app.route('/movies')
     @requires_auth('get:movies')
+    @cached_response('movies', ttl=CACHE_SHORT)
     def get_all_movies(payload):
-        selection = Movie.query.all()
-        movies = [movie.format() for movie in selection]
+        movies = Movie.format_all()
 
         # Abort if there are no movies in the database.
-        if len(movies) == 0:
+        if not movies:
             abort(404)
-        return jsonify({
-            'success': True,
-            'movies': movies
-        })
+        return ojson_list('movies', movies)
 
     '''
     Endpoint POST /movies:
@@ -178,7 +243,7 @@ def create_app(test_config=None):
     def create_movie(payload):
         try:
             # Get new movie data from request.
-            body = request.get_json()
+            body = get_body()
             req_title = body.get('title', None)
             req_release_date = body.get('release_date', None)
 
@@ -186,20 +251,21 @@ def create_app(test_config=None):
             if (req_title is None) or (req_release_date is None):
                 return abort(422)
 
-            # Validate that the birth date is the proper format, if not, abort.
-            if not date_valid(req_release_date):
+            # Validate that the release date is the proper format, if not, abort.
+            release_date = parse_date(req_release_date)
+            if release_date is None:
                 return abort(422)
 
-            # Format and create the movie object.
-            movie = Movie(title=req_title, release_date=req_release_date)
-
-            # Abort if the movie is already present in the database.
-            if movie.is_duplicate():
+            # Create a row in the database for the movie in a single statement, aborting if the movie is already present.
+            # A concurrent insert of the same value can still violate the plain unique constraint.
+            try:
+                movie = Movie.insert_if_new(title=req_title, release_date=release_date)
+            except IntegrityError:
+                db.session.rollback()
                 abort(422)
-
-            # Otherwise, create a row in the database for the movie.
-            movie.insert()
-            return jsonify({'success': True, "movie": movie.format()})
+            if movie is None:
+                abort(422)
+            return ojson({'success': True, "movie": movie})
         except AuthError:
             abort(422)
 
@@ -207,8 +273,9 @@ def create_app(test_config=None):
     Endpoint PATCH /movies/<movie_id>:
         - <movie_id> is the existing movie's id
         - requires 'patch:movies' permission.
-        - update the corresponding row for <movie_id>.
+        - updates the corresponding row for <movie_id> in a single UPDATE ... RETURNING statement.
         - responds with a 404 error if <movie_id> is not found.
+        - responds with a 422 error if the new title belongs to another movie.
         - returns status code 200 and json {"success": True, "movie": movie} where movie is the updated movie
             or appropriate status code indicating reason for failure.
     '''
@@ -217,25 +284,35 @@ def create_app(test_config=None):
     @requires_auth('patch:movies')
     def modify_movie(payload, movie_id):
         try:
-            # Find the movie with the given id, if it doesn't exist abort.
-            movie = Movie.query.filter(Movie.movie_id == movie_id).one_or_none()
-            if movie is None:
-                abort(404)
-
             # Retrieve the updated movie data.
-            body = request.get_json()
+            body = get_body()
             req_title = body.get('title', None)
             req_release_date = body.get('release_date', None)
 
-            # Update the movie with the new values.
+            # Validate and collect the new values.
+            values = {}
             if req_title is not None:
-                movie.title = req_title
+                values['title'] = req_title
             if req_release_date is not None:
-                if not date_valid(req_release_date):
+                release_date = parse_date(req_release_date)
+                if release_date is None:
                     abort(422)
-                movie.release_date = req_release_date
-            movie.update()
-            return jsonify({"success": True, "movie": movie.format()})
+                values['release_date'] = release_date
+
+            # Update the movie with the given id in a single statement, if it doesn't exist abort.
+            if values:
+                try:
+                    movie = Movie.update_by_id(movie_id, **values)
+                except IntegrityError:
+                    db.session.rollback()
+                    abort(422)
+            else:
+                movie = Movie.query.get(movie_id)
+                if movie is not None:
+                    movie = movie.format()
+            if movie is None:
+                abort(404)
+            return ojson({"success": True, "movie": movie})
         except AuthError:
             abort(422)
 
@@ -243,7 +320,7 @@ def create_app(test_config=None):
     Endpoint DELETE /movies/<movie_id>:
         - <movie_id> is the existing movie's id
         - requires 'delete:movies' permission.
-        - deletes the corresponding row for <movie_id>.
+        - deletes the corresponding row for <movie_id> in a single DELETE ... RETURNING statement.
         - responds with a 404 error if <movie_id> is not found.
         - returns status code 200 and json {"success": True, "delete": movie_id} where movie_id is the id for the deleted movie
             or appropriate status code indicating reason for failure.
@@ -253,13 +330,10 @@ def create_app(test_config=None):
     @requires_auth('delete:movies')
     def delete_movie(payload, movie_id):
         try:
-            # Find the movie with the given id, if it doesn't exist abort.
-            movie = Movie.query.filter(Movie.movie_id == movie_id).one_or_none()
-            if movie is None:
+            # Delete the movie with the given id in a single statement, if it doesn't exist abort.
+            if not Movie.delete_by_id(movie_id):
                 abort(404)
-
-            movie.delete()
-            return jsonify({"success": True, "delete": movie_id})
+            return ojson({"success": True, "delete": movie_id})
         except AuthError:
             abort(422)
 
@@ -273,11 +347,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
-            "success": False,
-            "error": 422,
-            "message": "unprocessable"
-        }), 422
+        return Response(ERROR_422, status=422, mimetype='application/json')
 
     '''
     Error handler for 401 Unauthorized.
@@ -285,11 +355,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(401)
     def unauthorized(error):
-        return jsonify({
-            "success": False,
-            "error": 401,
-            "message": "unauthorized"
-        }), 401
+        return Response(ERROR_401, status=401, mimetype='application/json')
 
     '''
     Error handler for 400 Bad Request.
@@ -297,11 +363,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
-            "success": False,
-            "error": 400,
-            "message": "bad request"
-        }), 400
+        return Response(ERROR_400, status=400, mimetype='application/json')
 
     '''
     Error handler for 404 Not Found.
@@ -309,11 +371,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
-            "success": False,
-            "error": 404,
-            "message": "resource not found"
-        }), 404
+        return Response(ERROR_404, status=404, mimetype='application/json')
 
     '''
     Error handler for AuthError.
@@ -321,11 +379,11 @@ def create_app(test_config=None):
 
     @app.errorhandler(AuthError)
     def handle_invalid_usage(error):
-        return jsonify({
+        return ojson({
             "success": False,
             "error": error.error,
             "message": error.status_code
-        }), error.error
+        }, error.error)
 
     return app
 
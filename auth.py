@@ -1,5 +1,9 @@
 import os
 import json
+import time
+import hashlib
+import logging
+import threading
 from flask import request, abort
 from functools import wraps
 from jose import jwt
@@ -9,6 +13,34 @@ AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
 ALGORITHMS = os.environ['ALGORITHMS']
 API_AUDIENCE = os.environ['API_AUDIENCE']
 
+logger = logging.getLogger(__name__)
+
+# Seconds for which the Auth0 signing keys are reused before being fetched again,
+# and the interval at which they are refreshed in the background.
+JWKS_TTL = 3600
+JWKS_REFRESH = 1800
+
+# Seconds to wait for Auth0 before giving up on fetching the signing keys.
+JWKS_TIMEOUT = 5
+
+# Minimum number of seconds between the fetches forced by tokens signed with a key id (kid) missing from the cache.
+JWKS_MISS_INTERVAL = 60
+
+# Seconds for which the expired signing keys keep being used after a failed fetch before Auth0 is tried again.
+JWKS_RETRY_INTERVAL = 30
+
+# Module level cache of the Auth0 signing keys, mapping each key id (kid) to its rsa key.
+_JWKS_CACHE = {'exp': 0, 'keys': {}, 'miss': 0, 'retry': 0}
+_JWKS_LOCK = threading.Lock()
+_JWKS_TIMER = None
+
+# Maximum number of verified tokens kept and the margin (in seconds) before expiry at which they are dropped.
+TOKEN_CACHE_SIZE = 1024
+TOKEN_EXP_MARGIN = 5
+
+# Module level cache of verified token payloads, mapping the sha256 digest of each token to its payload.
+_TOKEN_CACHE = {}
+
 # AuthError Exception
 '''
 AuthError Exception is a standardized way to communicate auth failure modes.
@@ -91,29 +123,170 @@ def check_permissions(permission, payload):
     return True
 
 
+'''
+fetch_jwks() method
+    It fetches the json web key set from Auth0 /.well-known/jwks.json.
+    It replaces the cached signing keys, keyed by key id (kid), and restarts their TTL.
+    It returns the new keys.
+'''
+
+
+def fetch_jwks():
+    # Retrieve json web key set from Auth0 for verification process.
+    myurl = 'https://%s/.well-known/jwks.json' % (AUTH0_DOMAIN)
+    jsonurl = urlopen(myurl, timeout=JWKS_TIMEOUT)
+    content = jsonurl.read().decode(jsonurl.headers.get_content_charset())
+    jwks = json.loads(content)
+
+    # Unpack the keys so that they can be looked up directly by kid.
+    keys = {
+        key['kid']: {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        } for key in jwks['keys']
+    }
+    _JWKS_CACHE['keys'] = keys
+    _JWKS_CACHE['exp'] = time.monotonic() + JWKS_TTL
+    return keys
+
+
+'''
+try_fetch_jwks() method
+    It must be called while holding _JWKS_LOCK.
+    It fetches the Auth0 signing keys with fetch_jwks() and returns them.
+    If the fetch fails, it logs the error, waits JWKS_RETRY_INTERVAL seconds before get_rsa_keys() tries again,
+    and returns None, so that the keys already cached keep being used.
+'''
+
+
+def try_fetch_jwks():
+    try:
+        return fetch_jwks()
+    except Exception:
+        logger.exception('Failed to fetch the Auth0 signing keys from %s', AUTH0_DOMAIN)
+        _JWKS_CACHE['retry'] = time.monotonic() + JWKS_RETRY_INTERVAL
+        return None
+
+
+'''
+get_rsa_keys() method
+    It returns the cached Auth0 signing keys, keyed by key id (kid).
+    It fetches the keys again only once the cached keys have expired.
+    The lock ensures that concurrent requests trigger a single fetch, whose outcome the requests waiting on it reuse.
+    If the fetch fails, the expired keys keep being used until the next attempt JWKS_RETRY_INTERVAL seconds later.
+    It raises an AuthError if there are no keys at all to fall back on.
+'''
+
+
+def get_rsa_keys():
+    now = time.monotonic()
+    if now < _JWKS_CACHE['exp'] or now < _JWKS_CACHE['retry']:
+        return _JWKS_CACHE['keys']
+
+    with _JWKS_LOCK:
+        # Another thread may have fetched the keys, or failed to, while we waited for the lock.
+        now = time.monotonic()
+        if now < _JWKS_CACHE['exp'] or now < _JWKS_CACHE['retry']:
+            keys = _JWKS_CACHE['keys']
+        else:
+            keys = try_fetch_jwks()
+            if keys is None:
+                keys = _JWKS_CACHE['keys']
+
+    if not keys:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys.'
+        }, 401)
+    return keys
+
+
+'''
+get_rsa_key(kid) method
+    @INPUTS
+        kid: the key id from the header of a json web token (string)
+    It returns the cached Auth0 signing key with the given key id, or None if Auth0 has no such key.
+    On a miss, i.e. after Auth0 rotates its keys, it fetches the keys again at most once every JWKS_MISS_INTERVAL seconds,
+    so that tokens with unknown key ids cannot make every request wait on Auth0.
+'''
+
+
+def get_rsa_key(kid):
+    rsa_key = get_rsa_keys().get(kid)
+    if rsa_key is not None:
+        return rsa_key
+
+    with _JWKS_LOCK:
+        # Another thread may have fetched the new keys while we waited for the lock.
+        rsa_key = _JWKS_CACHE['keys'].get(kid)
+        if rsa_key is None and time.monotonic() >= _JWKS_CACHE['miss']:
+            _JWKS_CACHE['miss'] = time.monotonic() + JWKS_MISS_INTERVAL
+            keys = try_fetch_jwks()
+            if keys is not None:
+                rsa_key = keys.get(kid)
+        return rsa_key
+
+
+'''
+refresh_jwks() method
+    It fetches the Auth0 signing keys and schedules itself to run again after JWKS_REFRESH seconds.
+    As JWKS_REFRESH is shorter than JWKS_TTL, requests keep finding fresh keys in the cache and never wait on Auth0.
+    A failed fetch is logged and leaves the cached keys in place until the next attempt or until they expire.
+'''
+
+
+def refresh_jwks():
+    global _JWKS_TIMER
+    try:
+        fetch_jwks()
+    except Exception:
+        logger.exception('Failed to refresh the Auth0 signing keys from %s', AUTH0_DOMAIN)
+    _JWKS_TIMER = threading.Timer(JWKS_REFRESH, refresh_jwks)
+    _JWKS_TIMER.daemon = True
+    _JWKS_TIMER.start()
+
+
+'''
+prefetch_jwks() method
+    It is called when the app is created so that the first request does not wait on Auth0.
+    It starts the background refresh of the signing keys once per process.
+'''
+
+
+def prefetch_jwks():
+    with _JWKS_LOCK:
+        if _JWKS_TIMER is None:
+            refresh_jwks()
+
+
 '''
 verify_decode_jwt(token) method
     @INPUTS
         token: a json web token (string)
+    It returns the cached payload if the same token has already been verified and has not yet expired.
     The token should be an Auth0 token with key id (kid).
-    It verifies the token using Auth0 /.well-known/jwks.json.
+    It verifies the token using the Auth0 /.well-known/jwks.json keys cached by get_rsa_keys(), looked up by get_rsa_key().
     It decodes the payload from the token.
     It validates the claims.
-    It return the decoded payload.
+    It caches and returns the decoded payload.
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 
 
 def verify_decode_jwt(token):
-    # Retrieve json web key set from Auth0 for verification process.
-    myurl = 'https://%s/.well-known/jwks.json' % (AUTH0_DOMAIN)
-    jsonurl = urlopen(myurl)
-    content = jsonurl.read().decode(jsonurl.headers.get_content_charset())
-    jwks = json.loads(content)
+    # Return the payload straight away if this token has already been verified.
+    digest = hashlib.sha256(token.encode()).digest()
+    cached = _TOKEN_CACHE.get(digest)
+    if cached is not None:
+        if cached['exp'] > time.time() + TOKEN_EXP_MARGIN:
+            return cached
+        _TOKEN_CACHE.pop(digest, None)
 
     # Obtain the Authorization Header.
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     # Verify that the key identifier (kid) is present.
     if 'kid' not in unverified_header:
@@ -122,16 +295,8 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    # Unpack the keys from the header.
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    # Look up the signing key matching the header, fetching the keys again if Auth0 has rotated them.
+    rsa_key = get_rsa_key(unverified_header['kid'])
 
     # If the keys are present, decode and return the token payload.
     if rsa_key:
@@ -143,6 +308,12 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
+
+            # Cache the payload, evicting the oldest entry once the cache is full.
+            if 'exp' in payload:
+                if len(_TOKEN_CACHE) >= TOKEN_CACHE_SIZE:
+                    _TOKEN_CACHE.pop(next(iter(_TOKEN_CACHE), None), None)
+                _TOKEN_CACHE[digest] = payload
             return payload
 
         # Process any errors according to the appropriate type.
@@ -185,13 +356,7 @@ def requires_auth(permission=''):
         def wrapper(*args, **kwargs):
             try:
                 token = get_token_auth_header()
-            except AuthError:
-                abort(401)
-            try:
                 payload = verify_decode_jwt(token)
-            except AuthError:
-                abort(401)
-            try:
                 check_permissions(permission, payload)
             except AuthError:
                 abort(401)
@@ -0,0 +1,70 @@
+import time
+import hashlib
+from flask import request, Response
+from functools import wraps
+
+# Seconds for which a cached response is served before it is rebuilt.
+CACHE_SHORT = 30
+CACHE_NORMAL = 300
+CACHE_LONG = 3600
+
+# Version counters for each cached resource, bumped whenever the resource is written.
+_VERSIONS = {}
+
+# Cached responses, mapping each resource to a (version, expiry, etag, body) tuple.
+_RESPONSES = {}
+
+
+'''
+invalidate(resource) method
+    @INPUTS
+        resource: string name of the cached resource (i.e. 'actors')
+    It bumps the version of the resource so that its cached response is rebuilt on the next request.
+    Other worker processes keep serving their own cached response until it expires.
+'''
+
+
+def invalidate(resource):
+    _VERSIONS[resource] = _VERSIONS.get(resource, 0) + 1
+
+
+'''
+@cached_response(resource, ttl) decorator method.
+    @INPUTS
+        resource: string name of the cached resource (i.e. 'actors')
+        ttl: number of seconds for which the response is cached (i.e. CACHE_SHORT)
+    It serves the cached body of the decorated method while the resource version is unchanged and the ttl has not elapsed.
+    It otherwise calls the decorated method and caches the body of a successful response.
+    It tags the response with an ETag and returns 304 Not Modified if the request's If-None-Match matches it.
+'''
+
+
+def cached_response(resource, ttl=CACHE_SHORT):
+    def cached_response_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            now = time.monotonic()
+            version = _VERSIONS.get(resource, 0)
+            cached = _RESPONSES.get(resource)
+
+            # Rebuild the response if the resource has been written or the cached response has expired.
+            if cached is None or cached[0] != version or cached[1] <= now:
+                response = f(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                cached = (version, now + ttl, hashlib.md5(body).hexdigest(), body)
+                _RESPONSES[resource] = cached
+
+            if request.if_none_match.contains(cached[2]):
+                response = Response(status=304)
+            else:
+                response = Response(cached[3], mimetype='application/json')
+            response.set_etag(cached[2])
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return cached_response_decorator
@@ -0,0 +1,23 @@
+import os
+import multiprocessing
+
+# Gunicorn configuration used by the Procfile.
+# Each gevent worker multiplexes many concurrent requests on one thread, yielding while it waits on Auth0 or Postgres.
+# Gunicorn monkey patches the standard library for gevent workers before the application is loaded.
+
+# Unlike sync workers (2 * CPUs + 1), one gevent worker per CPU is enough to keep every CPU busy.
+# Each worker has its own connection pool of up to pool_size + max_overflow (15) connections (see setup_db in models.py),
+# so workers * 15 must stay below the database's connection limit (max_connections, 100 by default for Postgres).
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gevent'
+worker_connections = 1000
+
+
+'''
+post_worker_init(worker) makes psycopg2 yield to the gevent loop while it waits on the database.
+'''
+
+
+def post_worker_init(worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -10,5 +10,11 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+# Creates any missing tables without running the migrations.
+@manager.command
+def create_db():
+    db.create_all()
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,26 @@
+"""empty message
+
+Revision ID: c5e1f0a7d2b4
+Revises: 8a373459d4fe
+Create Date: 2020-02-03 10:12:41.503918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1f0a7d2b4'
+down_revision = '8a373459d4fe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actor_name_lower', 'Actor', [sa.text('lower(name)')], unique=True)
+    op.create_index('ix_movie_title_lower', 'Movie', [sa.text('lower(title)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_movie_title_lower', table_name='Movie')
+    op.drop_index('ix_actor_name_lower', table_name='Actor')
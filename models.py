@@ -1,126 +1,349 @@
 import os
+import re
+import io
+import csv
+import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from sqlalchemy.sql import exists
-import dateutil.parser
+from sqlalchemy import func, cast, select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from cache import invalidate
 
 database_path = os.environ['DATABASE_URL']
 
 db = SQLAlchemy()
 
+# Number of rows sent to the database per statement by the bulk insert methods.
+BULK_BATCH_SIZE = 1000
+
 
 '''
 setup_db(app) binds a flask application and a SQLAlchemy service.
+It configures the connection pool shared by the requests served by the application,
+and psycopg2's fast execution helpers for statements executed with many parameter sets.
+The schema is not created here; run 'python manage.py create_db' once instead.
 '''
 
 
 def setup_db(app, db_path=database_path):
+    # Use the psycopg2 driver explicitly for Postgres urls (Heroku provides them as postgres://).
+    for prefix in ('postgres://', 'postgresql://'):
+        if db_path.startswith(prefix):
+            db_path = 'postgresql+psycopg2://' + db_path[len(prefix):]
+
+    # Pool settings only apply to Postgres; other databases (i.e. SQLite) keep SQLAlchemy's defaults.
+    engine_options = {}
+    if db_path.startswith('postgresql+psycopg2://'):
+        engine_options = {
+            # Each gunicorn worker holds up to 15 connections; see the connection limit in gunicorn.conf.py.
+            'pool_size': 10,
+            'max_overflow': 5,
+            'pool_pre_ping': True,
+            'pool_recycle': 300,
+            # Send multi-row inserts as a single INSERT ... VALUES per page, and other executemany() calls in batches.
+            'executemany_mode': 'values',
+            'executemany_values_page_size': BULK_BATCH_SIZE,
+            'executemany_batch_page_size': 500
+        }
+
     app.config["SQLALCHEMY_DATABASE_URI"] = db_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 
 '''
-date_valid(date_str) ensures that a valid date string has been entered so that it may be stored in the database.
+execute_cached(statement, params) executes a Core statement in the current session's transaction.
+The compiled SQL is kept in a module level cache, so statements built once at import time are only compiled once.
+'''
+
+_COMPILED_CACHE = {}
+
+
+def execute_cached(statement, params=None):
+    connection = db.session.connection().execution_options(compiled_cache=_COMPILED_CACHE)
+    return connection.execute(statement, params or {})
+
+
+'''
+copy_rows(table, rows) loads rows, given as dicts of column values, into table with COPY ... FROM STDIN.
+It runs in the current session's transaction, which the caller must commit.
+None is written as the explicit COPY_NULL marker, so that an empty string is loaded as an empty string rather than NULL.
+'''
+
+# Marks a NULL value in the CSV sent to COPY; csv writes both None and '' as an unquoted empty value.
+COPY_NULL = '\\N'
+
+
+def copy_rows(table, rows):
+    rows = list(rows)
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+
+    data = io.StringIO()
+    csv.writer(data).writerows([COPY_NULL if row[column] is None else row[column] for column in columns] for row in rows)
+    data.seek(0)
+
+    with db.session.connection().connection.cursor() as cursor:
+        cursor.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '%s')" % (
+            '"%s"' % table.name, ', '.join('"%s"' % column for column in columns), COPY_NULL), data)
+
+
+'''
+parse_date(date_str) returns the date entered in date_str so that it may be stored in the database, or None if it is not a valid date.
+ISO 8601 dates (i.e. '2020-07-01') and written out dates (i.e. 'July 1, 2020') are matched by precompiled regexes;
+other formats fall back to dateutil.
 '''
 
+# Matches an ISO 8601 date, optionally followed by a time and UTC offset (i.e. '2020-07-01T10:30:00Z').
+_ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?$')
+
+# Matches a written out date (i.e. 'November 19, 1992' or 'Nov 19 1992').
+_HUMAN_DATE_RE = re.compile(r'^([A-Za-z]+)\.? (\d{1,2}),? (\d{4})$')
+
+# Month numbers keyed by lower case English month names and their three letter abbreviations.
+_MONTH_NAMES = ('january', 'february', 'march', 'april', 'may', 'june', 'july',
+                'august', 'september', 'october', 'november', 'december')
+_MONTHS = {key: number for number, name in enumerate(_MONTH_NAMES, 1) for key in (name, name[:3])}
 
-def date_valid(date_str):
+# dateutil.parser.parse, imported on first use.
+_dateutil_parse = None
+
+
+def parse_date(date_str):
+    if not isinstance(date_str, str):
+        return None
+
+    match = _ISO_DATE_RE.match(date_str)
+    if match:
+        try:
+            return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+
+    match = _HUMAN_DATE_RE.match(date_str)
+    if match and match.group(1).lower() in _MONTHS:
+        try:
+            return datetime.date(int(match.group(3)), _MONTHS[match.group(1).lower()], int(match.group(2)))
+        except ValueError:
+            return None
+
+    # Only import dateutil once a date in any other format has to be parsed.
+    global _dateutil_parse
+    if _dateutil_parse is None:
+        from dateutil.parser import parse as _dateutil_parse
     try:
-        is_valid = dateutil.parser.parse(date_str)
+        return _dateutil_parse(date_str).date()
+    except (ValueError, OverflowError):
+        return None
+
+
+'''
+RowMixin adds writes of a single row by one statement, and of many rows in bulk, to a model.
+A model using it names its primary key column in _pk and its case-insensitively unique column in _unique_col,
+and the cached resource that every write invalidates in _cache_key.
+'''
+
+
+class RowMixin(object):
+    _pk = None
+    _unique_col = None
+    _cache_key = None
+
+    # Inserts a new row in a single INSERT ... ON CONFLICT DO NOTHING RETURNING statement and commits.
+    # Returns the new row formatted as by format(), or None if its unique column is already present (ignoring case).
+    @classmethod
+    def insert_if_new(cls, **values):
+        row = db.session.execute(pg_insert(cls.__table__).values(**values).on_conflict_do_nothing(
+            index_elements=[func.lower(getattr(cls, cls._unique_col))]).returning(*cls.__table__.c)).first()
+        db.session.commit()
+        if row is None:
+            return None
+        invalidate(cls._cache_key)
+        return dict(row)
+
+    # Inserts many rows, given as dicts of column values, with a single commit. Rows are sent in batches of BULK_BATCH_SIZE.
+    # Rows whose unique column is already present (ignoring case) are skipped by ON CONFLICT DO NOTHING rather than failing the batch.
+    @classmethod
+    def bulk_insert(cls, rows):
+        rows = list(rows)
+        statement = pg_insert(cls.__table__).on_conflict_do_nothing(
+            index_elements=[func.lower(getattr(cls, cls._unique_col))])
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            db.session.execute(statement, rows[start:start + BULK_BATCH_SIZE])
+        db.session.commit()
+        invalidate(cls._cache_key)
+
+    # Loads many rows, given as dicts of column values, with a single COPY ... FROM STDIN and commit.
+    # This is the fastest way to load rows into Postgres, but unlike bulk_insert a duplicate fails the whole load.
+    @classmethod
+    def bulk_copy(cls, rows):
+        copy_rows(cls.__table__, rows)
+        db.session.commit()
+        invalidate(cls._cache_key)
+
+    # Saves many instances with a single commit, skipping the per-object unit of work bookkeeping of insert().
+    # The instances do not get their primary key back (return_defaults=False), so use insert() when the id is needed.
+    @classmethod
+    def bulk_save(cls, objs):
+        db.session.bulk_save_objects(objs, return_defaults=False)
+        db.session.commit()
+        invalidate(cls._cache_key)
+
+    # Updates the row with the given primary key in a single UPDATE ... RETURNING statement and commits.
+    # Returns the updated row formatted as by format(), or None if there is no row with that primary key.
+    @classmethod
+    def update_by_id(cls, pk, **values):
+        row = db.session.execute(update(cls.__table__).where(
+            getattr(cls, cls._pk) == pk).values(**values).returning(*cls.__table__.c)).first()
+        db.session.commit()
+        if row is None:
+            return None
+        invalidate(cls._cache_key)
+        return dict(row)
+
+    # Deletes the row with the given primary key in a single DELETE ... RETURNING statement and commits.
+    # Returns False if there is no row with that primary key.
+    @classmethod
+    def delete_by_id(cls, pk):
+        row = db.session.execute(delete(cls.__table__).where(
+            getattr(cls, cls._pk) == pk).returning(getattr(cls, cls._pk))).first()
+        db.session.commit()
+        if row is None:
+            return False
+        invalidate(cls._cache_key)
         return True
-    except ValueError:
-        return False
 
 
 '''
 Movie is a persistent movie entity that extends the base SQLAlchemy Model.
+Every write invalidates the cached GET /movies response.
 '''
 
 
-class Movie(db.Model):
+class Movie(RowMixin, db.Model):
     __tablename__ = 'Movie'
 
+    # Columns and cached resource used by the RowMixin writes.
+    _pk = 'movie_id'
+    _unique_col = 'title'
+    _cache_key = 'movies'
+
     movie_id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False, unique=True)
     release_date = db.Column(db.Date, nullable=False)
 
+    # Enforces case-insensitive uniqueness of the title within the database.
+    __table_args__ = (db.Index('ix_movie_title_lower', func.lower(title), unique=True),)
+
     def __init__(self, title, release_date):
         self.title = title
         self.release_date = release_date
 
-    # Inserts a new movie into a database. It must have a unique name and id. It must have a release date.
+    # Inserts a new movie into a database. It must have a unique title and id, otherwise an IntegrityError is raised. It must have a release date.
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        invalidate(self._cache_key)
 
     # Updates a movie in the database. The movie_id must already exist.
     def update(self):
         db.session.commit()
+        invalidate(self._cache_key)
 
     # Deletes a movie in the database. The movie_id must already exist.
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        invalidate(self._cache_key)
+
+    # Returns every movie formatted as by format(), as the text of a JSON array built in a single query on the database side.
+    # Returns None if there are no movies.
+    @classmethod
+    def format_all(cls):
+        return execute_cached(MOVIES_JSON).scalar()
 
     def format(self):
         return {'movie_id': self.movie_id,
                 'title': self.title,
-                'release_date': self.release_date.strftime('%Y-%m-%d')}
+                'release_date': self.release_date}
 
     def __repr__(self):
         return '<Movie %r>' % self
 
-    # Determines if the movie to be added is already in the database.
-    def is_duplicate(self):
-        return db.session.query(exists().where(func.lower(Movie.title) == func.lower(
-            self.title))).scalar()
-
 
 '''
 Actor is a persistent actor entity that extends the base SQLAlchemy Model.
+Every write invalidates the cached GET /actors response.
 '''
 
 
-class Actor(db.Model):
+class Actor(RowMixin, db.Model):
     __tablename__ = 'Actor'
 
+    # Columns and cached resource used by the RowMixin writes.
+    _pk = 'actor_id'
+    _unique_col = 'name'
+    _cache_key = 'actors'
+
     actor_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False, unique=True)
     birth_date = db.Column(db.Date, nullable=False)
     gender = db.Column(db.String, nullable=False)
 
+    # Enforces case-insensitive uniqueness of the name within the database.
+    __table_args__ = (db.Index('ix_actor_name_lower', func.lower(name), unique=True),)
+
     def __init__(self, name, birth_date, gender):
         self.name = name
         self.birth_date = birth_date
         self.gender = gender
 
-    # Inserts a new actor into a database. It must have a unique name and id. It must have a birth_date and gender.
+    # Inserts a new actor into a database. It must have a unique name and id, otherwise an IntegrityError is raised. It must have a birth_date and gender.
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        invalidate(self._cache_key)
 
     # Updates an actor in the database. The actor_id must already exist.
     def update(self):
         db.session.commit()
+        invalidate(self._cache_key)
 
     # Deletes an actor in the database. The actor_id must already exist.
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        invalidate(self._cache_key)
+
+    # Returns every actor formatted as by format(), as the text of a JSON array built in a single query on the database side.
+    # Returns None if there are no actors.
+    @classmethod
+    def format_all(cls):
+        return execute_cached(ACTORS_JSON).scalar()
 
     def format(self):
         return {'actor_id': self.actor_id,
                 'name': self.name,
-                'birth_date': self.birth_date.strftime('%Y-%m-%d'),
+                'birth_date': self.birth_date,
                 'gender': self.gender}
 
     def __repr__(self):
         return '<Actor %r>' % self
 
-    # Determines if the actor to be added is already in the database.
-    def is_duplicate(self):
-        return db.session.query(exists().where(func.lower(Actor.name) == func.lower(
-            self.name))).scalar()
+
+'''
+Statements used by format_all(), built once at import time. Each returns the table as the text of a JSON array.
+'''
+
+MOVIES_JSON = select([cast(func.json_agg(func.json_build_object(
+    'movie_id', Movie.movie_id,
+    'title', Movie.title,
+    'release_date', func.to_char(Movie.release_date, 'YYYY-MM-DD'))), db.Text)])
+
+ACTORS_JSON = select([cast(func.json_agg(func.json_build_object(
+    'actor_id', Actor.actor_id,
+    'name', Actor.name,
+    'birth_date', func.to_char(Actor.birth_date, 'YYYY-MM-DD'),
+    'gender', Actor.gender)), db.Text)])
@@ -1,9 +1,14 @@
 import os
-import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import unittest
+import datetime
+from unittest import mock
+from urllib.error import URLError
+from sqlalchemy import event
 from app import create_app
-from models import setup_db
+from models import setup_db, db, Movie, Actor
+from cache import invalidate
+import auth
 
 '''
 CastingTestCase
@@ -12,27 +17,28 @@ CastingTestCase
 
 
 class CastingTestCase(unittest.TestCase):
-    def setUp(self):
-        # Define test variables and initialize app.
-        self.app = create_app()
-        self.client = self.app.test_client
+    @classmethod
+    def setUpClass(cls):
+        # Define test variables and initialize app once for all of the tests.
+        cls.app = create_app()
+        cls.client = cls.app.test_client()
         database_path = 'postgresql://postgres@localhost:5432/casting_test'
-        setup_db(self.app, database_path)
+        setup_db(cls.app, database_path)
 
         token = os.environ['TEST_TOKEN']
         bad_token = os.environ['BAD_TOKEN']
 
-        self.header = {
+        cls.HEADER = {
             "Authorization": "Bearer {}".format(token)
         }
 
-        self.bad_header = {
+        cls.BAD_HEADER = {
             "Authorization": "Bearer {}".format(bad_token)
         }
 
         # This is a sample actor to be used during the test
         # of the insertion endpoint.
-        self.new_actor = {
+        cls.new_actor = {
             "name": "Joe Smith",
             "birth_date": "November 19, 1992",
             "gender": "M"
@@ -40,14 +46,14 @@ class CastingTestCase(unittest.TestCase):
 
         # This is a sample movie to be used during the test
         # of the insertion endpoint.
-        self.new_movie = {
+        cls.new_movie = {
             "title": "Big Blockbuster 2021",
             "release_date": "July 4, 2021"
         }
 
         # This is a sample actor to be used during the test
         # of the patch endpoint.
-        self.updated_actor = {
+        cls.updated_actor = {
             "name": "Josie D. Smith",
             "birth_date": "November 20, 1992",
             "gender": "F"
@@ -55,33 +61,63 @@ class CastingTestCase(unittest.TestCase):
 
         # This is a sample movie to be used during the test
         # of the patch endpoint.
-        self.updated_movie = {
+        cls.updated_movie = {
             "title": "Bad Movie",
             "release_date": "December 31, 2021"
         }
 
-        # Binds the app to the current context.
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
+    def setUp(self):
+        # Run each test inside a transaction that is rolled back in tearDown, so that every test
+        # starts from the data loaded from casting.psql and nothing is committed to the database.
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = db.create_scoped_session(options={'bind': self.connection, 'binds': {}})
+        db.session.begin_nested()
+
+        # The application commits (or rolls back) the savepoint, so open a new one each time it ends.
+        @event.listens_for(db.session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
 
     def tearDown(self):
         # Executed after reach test.
-        pass
+        # Discard everything the test wrote, along with any list response cached from it.
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        self.ctx.pop()
+        invalidate('actors')
+        invalidate('movies')
 
     def test_get_actors(self):
         # Test for successful retrieval of all actors.
-        res = self.client().get('/actors', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.get('/actors', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['actors']))
 
+    def test_get_actors_304(self):
+        # Test that a repeated retrieval with the returned ETag is not modified.
+        res = self.client.get('/actors', headers=self.HEADER)
+        etag = res.headers['ETag']
+        res = self.client.get('/actors', headers=dict(self.HEADER, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.data, b'')
+
     def test_get_actors_404_fail(self):
         # Test fail for get actors at bad endpoint.
-        res = self.client().get('/actors1', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.get('/actors1', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -90,8 +126,8 @@ class CastingTestCase(unittest.TestCase):
     def test_get_actors_401_fail(self):
         # Test fail when do not have 'get:actors' permission
         # ie. not Casting Assistant, Casting Director or Executive Producer.
-        res = self.client().get('/actors', headers=self.bad_header)
-        data = json.loads(res.data)
+        res = self.client.get('/actors', headers=self.BAD_HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
@@ -99,17 +135,27 @@ class CastingTestCase(unittest.TestCase):
 
     def test_get_movies(self):
         # Test for successful retrieval of all movies.
-        res = self.client().get('/movies', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.get('/movies', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['movies']))
 
+    def test_get_movies_304(self):
+        # Test that a repeated retrieval with the returned ETag is not modified.
+        res = self.client.get('/movies', headers=self.HEADER)
+        etag = res.headers['ETag']
+        res = self.client.get('/movies', headers=dict(self.HEADER, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.data, b'')
+
     def test_get_movies_404_fail(self):
         # Test fail for get movies at bad endpoint.
-        res = self.client().get('/movies1', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.get('/movies1', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -118,8 +164,8 @@ class CastingTestCase(unittest.TestCase):
     def test_get_movies_401_fail(self):
         # Test fail when do not have 'get:movies' permission
         # ie. does not have Casting Assistant, Casting Director or Executive Producer role.
-        res = self.client().get('/movies', headers=self.bad_header)
-        data = json.loads(res.data)
+        res = self.client.get('/movies', headers=self.BAD_HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
@@ -127,8 +173,8 @@ class CastingTestCase(unittest.TestCase):
 
     def test_post_new_actor(self):
         # Test for the successful creation of a new actor.
-        res = self.client().post('/actors', headers=self.header, json=self.new_actor)
-        data = json.loads(res.data)
+        res = self.client.post('/actors', headers=self.HEADER, json=self.new_actor)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
@@ -137,8 +183,18 @@ class CastingTestCase(unittest.TestCase):
     def test_post_new_actor_422_fail(self):
         # Test the failure case for creating a new actor,
         #  ie. bad data passed in request.
-        res = self.client().post('/actors', headers=self.header, json={})
-        data = json.loads(res.data)
+        res = self.client.post('/actors', headers=self.HEADER, json={})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+    def test_post_new_actor_422_duplicate(self):
+        # Test the failure case for creating a new actor,
+        #  ie. an actor with the same name (ignoring case) already exists.
+        res = self.client.post('/actors', headers=self.HEADER, json=dict(self.new_actor, name="joe BLOGGS"))
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data['success'], False)
@@ -147,17 +203,46 @@ class CastingTestCase(unittest.TestCase):
     def test_post_new_actor_401_fail(self):
         # Test the failure case when the user doesn't have 'post:actor' permission
         # ie. the user does not have Casting Director or Executive Producer role.
-        res = self.client().post('/actors', headers=self.bad_header, json=self.new_actor)
-        data = json.loads(res.data)
+        res = self.client.post('/actors', headers=self.BAD_HEADER, json=self.new_actor)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unauthorized')
 
+    def test_post_new_actor_iso_date(self):
+        # Test for the successful creation of a new actor with an ISO 8601 birth date.
+        res = self.client.post('/actors', headers=self.HEADER, json=dict(self.new_actor, birth_date="1992-11-19"))
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['actor']['birth_date'], '1992-11-19')
+
+    def test_post_new_actor_422_invalid_date(self):
+        # Test the failure case for creating a new actor,
+        #  ie. a written out birth date that does not exist.
+        res = self.client.post('/actors', headers=self.HEADER, json=dict(self.new_actor, birth_date="February 30, 1992"))
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+    def test_post_new_actor_400_fail(self):
+        # Test the failure case for creating a new actor,
+        #  ie. the request body is not valid JSON.
+        res = self.client.post('/actors', headers=self.HEADER, data='not json', content_type='application/json')
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_post_new_movie(self):
         # Test for the successful creation of a new movie.
-        res = self.client().post('/movies', headers=self.header, json=self.new_movie)
-        data = json.loads(res.data)
+        res = self.client.post('/movies', headers=self.HEADER, json=self.new_movie)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
@@ -166,8 +251,18 @@ class CastingTestCase(unittest.TestCase):
     def test_post_new_movie_422_fail(self):
         # Test the failure case for creating a new movie,
         #  ie. bad data passed in request.
-        res = self.client().post('/movies', headers=self.header, json={})
-        data = json.loads(res.data)
+        res = self.client.post('/movies', headers=self.HEADER, json={})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+    def test_post_new_movie_422_duplicate(self):
+        # Test the failure case for creating a new movie,
+        #  ie. a movie with the same title (ignoring case) already exists.
+        res = self.client.post('/movies', headers=self.HEADER, json=dict(self.new_movie, title="CATS big adventure"))
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data['success'], False)
@@ -176,27 +271,56 @@ class CastingTestCase(unittest.TestCase):
     def test_post_new_movie_401_fail(self):
         # Test the failure case when the user doesn't have 'post:movie' permission
         # ie. the user does not have an Executive Producer role.
-        res = self.client().post('/movies', headers=self.bad_header, json=self.new_movie)
-        data = json.loads(res.data)
+        res = self.client.post('/movies', headers=self.BAD_HEADER, json=self.new_movie)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unauthorized')
 
+    def test_post_new_movie_422_invalid_date(self):
+        # Test the failure case for creating a new movie,
+        #  ie. an ISO 8601 release date that does not exist.
+        res = self.client.post('/movies', headers=self.HEADER, json=dict(self.new_movie, release_date="2021-02-30"))
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+    def test_post_new_movie_400_fail(self):
+        # Test the failure case for creating a new movie,
+        #  ie. the request body is not a JSON object.
+        res = self.client.post('/movies', headers=self.HEADER, json=[self.new_movie])
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_patch_actor(self):
         # Test for the successful update of an existing actor.
-        res = self.client().patch('/actors/1', headers=self.header, json=self.updated_actor)
-        data = json.loads(res.data)
+        res = self.client.patch('/actors/1', headers=self.HEADER, json=self.updated_actor)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['actor']))
 
+    def test_patch_actor_abbreviated_date(self):
+        # Test for the successful update of an actor's birth date given with an abbreviated month.
+        res = self.client.patch('/actors/1', headers=self.HEADER, json={"birth_date": "Nov 20 1992"})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['actor']['birth_date'], '1992-11-20')
+
     def test_patch_actor_404_fail(self):
         # Test the failure case for updating an actor,
         #  ie. non-existent actor.
-        res = self.client().patch('/actors/500', headers=self.header, json=self.updated_actor)
-        data = json.loads(res.data)
+        res = self.client.patch('/actors/500', headers=self.HEADER, json=self.updated_actor)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -205,27 +329,47 @@ class CastingTestCase(unittest.TestCase):
     def test_patch_actor_401_fail(self):
         # Test the failure case when the user doesn't have 'patch:actor' permission
         # ie. the user does not have Casting Director or Executive Producer role.
-        res = self.client().patch('/actors/5', headers=self.bad_header, json=self.updated_actor)
-        data = json.loads(res.data)
+        res = self.client.patch('/actors/5', headers=self.BAD_HEADER, json=self.updated_actor)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unauthorized')
 
+    def test_patch_actor_422_duplicate_name(self):
+        # Test the failure case for updating an actor,
+        #  ie. the new name belongs to another actor (ignoring case).
+        res = self.client.patch('/actors/1', headers=self.HEADER, json={"name": "pamela ANDERSON"})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
     def test_patch_movie(self):
         # Test for the successful update of an existing movie.
-        res = self.client().patch('/movies/3', headers=self.header, json=self.updated_movie)
-        data = json.loads(res.data)
+        res = self.client.patch('/movies/3', headers=self.HEADER, json=self.updated_movie)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['movie']))
 
+    def test_patch_movie_422_invalid_date(self):
+        # Test the failure case for updating a movie,
+        #  ie. the release date is not a string.
+        res = self.client.patch('/movies/3', headers=self.HEADER, json={"release_date": 20210704})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
     def test_patch_movie_404_fail(self):
         # Test the failure case for updating an movie,
         #  ie. non-existent movie.
-        res = self.client().patch('/movies/500', headers=self.header, json=self.updated_movie)
-        data = json.loads(res.data)
+        res = self.client.patch('/movies/500', headers=self.HEADER, json=self.updated_movie)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -234,17 +378,27 @@ class CastingTestCase(unittest.TestCase):
     def test_patch_movie_401_fail(self):
         # Test the failure case when the user doesn't have 'patch:movie' permission
         # ie. the user does not have Casting Director or Executive Producer role.
-        res = self.client().patch('/movies/6', headers=self.bad_header, json=self.updated_movie)
-        data = json.loads(res.data)
+        res = self.client.patch('/movies/6', headers=self.BAD_HEADER, json=self.updated_movie)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unauthorized')
 
+    def test_patch_movie_422_duplicate_title(self):
+        # Test the failure case for updating a movie,
+        #  ie. the new title belongs to another movie (ignoring case).
+        res = self.client.patch('/movies/3', headers=self.HEADER, json={"title": "new bedtime for BONZO"})
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
     def test_delete_actor(self):
         # Test for the successful deletion of an actor.
-        res = self.client().delete('/actors/5', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.delete('/actors/5', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
@@ -252,8 +406,8 @@ class CastingTestCase(unittest.TestCase):
     def test_delete_actor_404_fail(self):
         # Test for failure when the actor to be deleted
         # doesn't exist.
-        res = self.client().delete('/actors/500', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.delete('/actors/500', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -262,8 +416,8 @@ class CastingTestCase(unittest.TestCase):
     def test_delete_actor_401_fail(self):
         # Test for failure when the user doesn't have 'delete:actor' permission
         # ie. the user does not have Casting Director or Executive Producer role.
-        res = self.client().delete('/actors/1', headers=self.bad_header)
-        data = json.loads(res.data)
+        res = self.client.delete('/actors/1', headers=self.BAD_HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
@@ -271,8 +425,8 @@ class CastingTestCase(unittest.TestCase):
 
     def test_delete_movie(self):
         # Test for the successful deletion of a movie.
-        res = self.client().delete('/movies/2', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.delete('/movies/2', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
@@ -280,8 +434,8 @@ class CastingTestCase(unittest.TestCase):
     def test_delete_movie_404_fail(self):
         # Test for failure when the movie to be deleted
         # doesn't exist.
-        res = self.client().delete('/movies/500', headers=self.header)
-        data = json.loads(res.data)
+        res = self.client.delete('/movies/500', headers=self.HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
@@ -290,13 +444,119 @@ class CastingTestCase(unittest.TestCase):
     def test_delete_movie_401_fail(self):
         # Test for failure when the user doesn't have 'delete:movie' permission
         # ie. the user does not have an Executive Producer role.
-        res = self.client().delete('/movies/2', headers=self.bad_header)
-        data = json.loads(res.data)
+        res = self.client.delete('/movies/2', headers=self.BAD_HEADER)
+        data = res.get_json()
 
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'unauthorized')
 
+    def test_bulk_insert_actors(self):
+        # Test that bulk inserted actors are listed, skipping those whose name is already present (ignoring case).
+        Actor.bulk_insert([
+            {"name": "Joe Smith", "birth_date": datetime.date(1992, 11, 19), "gender": "M"},
+            {"name": "JOE BLOGGS", "birth_date": datetime.date(1979, 12, 12), "gender": "M"}
+        ])
+        res = self.client.get('/actors', headers=self.HEADER)
+        names = [actor['name'] for actor in res.get_json()['actors']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(names), 4)
+        self.assertIn('Joe Smith', names)
+        self.assertNotIn('JOE BLOGGS', names)
+
+    def test_bulk_copy_movies(self):
+        # Test that movies loaded with COPY are listed, including one with an empty title.
+        Movie.bulk_copy([
+            {"title": "Big Blockbuster 2021", "release_date": datetime.date(2021, 7, 4)},
+            {"title": "", "release_date": datetime.date(2021, 7, 5)}
+        ])
+        res = self.client.get('/movies', headers=self.HEADER)
+        titles = [movie['title'] for movie in res.get_json()['movies']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(titles), 4)
+        self.assertIn('Big Blockbuster 2021', titles)
+        self.assertIn('', titles)
+
+    def test_bulk_save_movies(self):
+        # Test that movies saved in bulk are listed.
+        Movie.bulk_save([Movie(title="Big Blockbuster 2021", release_date=datetime.date(2021, 7, 4))])
+        res = self.client.get('/movies', headers=self.HEADER)
+        titles = [movie['title'] for movie in res.get_json()['movies']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(titles), 3)
+        self.assertIn('Big Blockbuster 2021', titles)
+
+
+'''
+JwksCacheTestCase
+    This class represents the tests of the cache of the Auth0 signing keys, with Auth0 replaced by a mock.
+'''
+
+
+class JwksCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        # Start each test from a fresh cache holding the signing key 'old', and restore the cache afterwards.
+        cache_patch = mock.patch.dict(auth._JWKS_CACHE, {'exp': 0, 'keys': {}, 'miss': 0, 'retry': 0})
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        auth._JWKS_CACHE['keys'] = {'old': self.rsa_key('old')}
+        auth._JWKS_CACHE['exp'] = auth.time.monotonic() + auth.JWKS_TTL
+
+        # Auth0 answers with the signing key 'new'.
+        response = mock.Mock()
+        response.read.return_value = json.dumps({'keys': [self.rsa_key('new')]}).encode()
+        response.headers.get_content_charset.return_value = 'utf-8'
+        urlopen_patch = mock.patch('auth.urlopen', return_value=response)
+        self.urlopen = urlopen_patch.start()
+        self.addCleanup(urlopen_patch.stop)
+
+    @staticmethod
+    def rsa_key(kid):
+        return {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n', 'e': 'AQAB'}
+
+    def test_known_kid(self):
+        # Test that a cached key is returned without fetching the keys.
+        self.assertEqual(auth.get_rsa_key('old'), self.rsa_key('old'))
+        self.assertEqual(self.urlopen.call_count, 0)
+
+    def test_unknown_kid(self):
+        # Test that a key missing from the cache is fetched, at most once every JWKS_MISS_INTERVAL seconds.
+        self.assertEqual(auth.get_rsa_key('new'), self.rsa_key('new'))
+        self.assertEqual(auth.get_rsa_key('other'), None)
+        self.assertEqual(self.urlopen.call_count, 1)
+
+        auth._JWKS_CACHE['miss'] = 0
+        self.assertEqual(auth.get_rsa_key('other'), None)
+        self.assertEqual(self.urlopen.call_count, 2)
+
+    def test_expired_keys(self):
+        # Test that expired keys are fetched once, after which the fetched keys are cached.
+        auth._JWKS_CACHE['exp'] = 0
+        self.assertEqual(auth.get_rsa_keys(), {'new': self.rsa_key('new')})
+        self.assertEqual(auth.get_rsa_keys(), {'new': self.rsa_key('new')})
+        self.assertEqual(self.urlopen.call_count, 1)
+
+    def test_expired_keys_fetch_fail(self):
+        # Test that the expired keys keep being used after a failed fetch, which is not retried straight away.
+        auth._JWKS_CACHE['exp'] = 0
+        self.urlopen.side_effect = URLError('unreachable')
+        with mock.patch('auth.logger'):
+            self.assertEqual(auth.get_rsa_key('old'), self.rsa_key('old'))
+            self.assertEqual(auth.get_rsa_key('old'), self.rsa_key('old'))
+        self.assertEqual(self.urlopen.call_count, 1)
+
+    def test_no_keys_fetch_fail(self):
+        # Test that an AuthError is raised when the keys cannot be fetched and none are cached.
+        auth._JWKS_CACHE.update(exp=0, keys={})
+        self.urlopen.side_effect = URLError('unreachable')
+        with mock.patch('auth.logger'):
+            with self.assertRaises(auth.AuthError) as error:
+                auth.get_rsa_keys()
+        self.assertEqual(error.exception.status_code, 401)
+
 
 # Make the tests conveniently executable.
 if __name__ == "__main__":